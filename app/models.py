@@ -19,23 +19,194 @@ All of the models are stored in this module
 Models
 ------
 Pet - A Pet used in the Pet Store
+Shard - A partition of the Pet store with its own lock and indexes
+NameCounts - Counts the Pets per name across all of the shards
 
 """
+import heapq
+import itertools
 import threading
 
+# Number of partitions that the Pet store is split into
+SHARD_COUNT = 16
+
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
     pass
 
+class NameCounts(object):
+    """
+    Class that counts the Pets per name across all of the shards
+
+    The names are striped by hash, each stripe with its own lock, so that
+    shards updating different names do not block each other and the number
+    of distinct names is the sum of the stripe sizes.
+    """
+
+    def __init__(self, stripes=SHARD_COUNT):
+        """ Initialize empty NameCounts """
+        self.stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+
+    def add(self, name):
+        """ Counts one more Pet with the given name """
+        lock, counts = self.__stripe(name)
+        with lock:
+            counts[name] = counts.get(name, 0) + 1
+
+    def remove(self, name):
+        """ Counts one less Pet with the given name """
+        lock, counts = self.__stripe(name)
+        with lock:
+            counts[name] -= 1
+            if not counts[name]:
+                del counts[name]
+
+    def clear(self):
+        """ Removes all of the counts """
+        for lock, counts in self.stripes:
+            with lock:
+                counts.clear()
+
+    def distinct(self):
+        """ Returns the number of distinct names """
+        return sum(len(counts) for _, counts in self.stripes)
+
+    def __stripe(self, name):
+        """ Returns the (lock, counts) stripe that holds a name """
+        return self.stripes[hash(name) % len(self.stripes)]
+
+class Shard(object):
+    """
+    Class that represents a partition of the Pet store
+
+    Each shard has its own lock so that writers to different shards do
+    not block each other. Pets are indexed by id, category and name and
+    the shard keeps a count of its Pets per category. Every read and
+    write of the shard holds its lock.
+    """
+
+    def __init__(self, name_counts):
+        """ Initialize an empty Shard
+
+        Args:
+            name_counts (NameCounts): the name counts shared by all of the shards
+        """
+        self.lock = threading.Lock()
+        self.pets = {}
+        self.categories = {}
+        self.names = {}
+        self.indexed = {}
+        self.category_counts = {}
+        self.name_counts = name_counts
+
+    def add(self, pet):
+        """ Adds a Pet to the shard """
+        keys = self.__keys(pet)
+        with self.lock:
+            self.pets[pet.id] = pet
+            self.__index(pet, keys)
+
+    def update(self, pet):
+        """ Replaces a Pet that is already in the shard """
+        keys = self.__keys(pet)
+        with self.lock:
+            if pet.id in self.pets:
+                self.pets[pet.id] = pet
+                self.__unindex(pet.id)
+                self.__index(pet, keys)
+
+    def remove(self, pet):
+        """ Removes a Pet from the shard """
+        with self.lock:
+            if pet.id not in self.pets:
+                raise KeyError(pet.id)
+            self.__unindex(pet.id)
+            del self.pets[pet.id]
+
+    def clear(self):
+        """ Removes all of the Pets from the shard
+
+        The shared name counts are not changed, they must be cleared separately
+        """
+        with self.lock:
+            self.pets.clear()
+            self.categories.clear()
+            self.names.clear()
+            self.indexed.clear()
+            self.category_counts.clear()
+
+    def counts(self):
+        """ Returns the number of Pets and a copy of the counts per category """
+        with self.lock:
+            return len(self.pets), dict(self.category_counts)
+
+    def get(self, pet_id):
+        """ Returns the Pet with the given id or None """
+        with self.lock:
+            return self.pets.get(pet_id)
+
+    def get_many(self, pet_ids):
+        """ Returns a dictionary of the Pets found for the given ids """
+        with self.lock:
+            return dict((pet_id, self.pets[pet_id]) for pet_id in pet_ids if pet_id in self.pets)
+
+    def sorted_pets(self, index=None, key=None):
+        """ Returns the (id, Pet) pairs of the shard ordered by id
+
+        Args:
+            index (dict): the category or name index to select from
+            key (string): the category or name to select
+        """
+        with self.lock:
+            if index is None:
+                pets = self.pets.values()
+            else:
+                pets = index.get(key, {}).values()
+            return sorted((pet.id, pet) for pet in pets)
+
+    @staticmethod
+    def __keys(pet):
+        """ Returns the (name, category) index keys of a Pet
+
+        Unusable keys raise here, before the shard is changed, so that a
+        failed write leaves no partial state behind
+        """
+        keys = (pet.name, pet.category)
+        hash(keys)
+        return keys
+
+    def __index(self, pet, keys):
+        """ Adds a Pet to the category and name indexes """
+        name, category = keys
+        self.indexed[pet.id] = keys
+        self.categories.setdefault(category, {})[pet.id] = pet
+        self.names.setdefault(name, {})[pet.id] = pet
+        self.category_counts[category] = self.category_counts.get(category, 0) + 1
+        self.name_counts.add(name)
+
+    def __unindex(self, pet_id):
+        """ Removes a Pet from the indexes using the values it was indexed with """
+        name, category = self.indexed.pop(pet_id)
+        for index, key in ((self.categories, category), (self.names, name)):
+            del index[key][pet_id]
+            if not index[key]:
+                del index[key]
+        self.category_counts[category] -= 1
+        if not self.category_counts[category]:
+            del self.category_counts[category]
+        self.name_counts.remove(name)
+
 class Pet(object):
     """
     Class that represents a Pet
 
     This version uses an in-memory collection of pets for testing
+    that is partitioned into shards by id
     """
-    lock = threading.Lock()
-    data = []
-    index = 0
+    names = NameCounts()
+    shards = [Shard(names) for _ in range(SHARD_COUNT)]
+    # next() on a count is atomic in CPython so ids need no shared lock
+    ids = itertools.count(1)
 
     def __init__(self, pet_id=0, name='', category=''):
         """ Initialize a Pet """
@@ -49,16 +220,13 @@ class Pet(object):
         """
         if self.id == 0:
             self.id = self.__next_index()
-            Pet.data.append(self)
+            Pet.shard(self.id).add(self)
         else:
-            for i in range(len(Pet.data)):
-                if Pet.data[i].id == self.id:
-                    Pet.data[i] = self
-                    break
+            Pet.shard(self.id).update(self)
 
     def delete(self):
         """ Removes a Pet from the data store """
-        Pet.data.remove(self)
+        Pet.shard(self.id).remove(self)
 
     def serialize(self):
         """ Serializes a Pet into a dictionary """
@@ -73,41 +241,100 @@ class Pet(object):
         """
         if not isinstance(data, dict):
             raise DataValidationError('Invalid pet: body of request contained bad or no data')
-        try:
-            self.name = data['name']
-            self.category = data['category']
-        except KeyError as err:
-            raise DataValidationError('Invalid pet: missing ' + err.args[0])
+        # validate every field before assigning any so a bad payload changes nothing
+        for field in ('name', 'category'):
+            if field not in data:
+                raise DataValidationError('Invalid pet: missing ' + field)
+            if not isinstance(data[field], basestring):
+                raise DataValidationError('Invalid pet: ' + field + ' must be a string')
+        self.name = data['name']
+        self.category = data['category']
         return
 
     @classmethod
     def __next_index(cls):
         """ Generates the next index in a continual sequence """
-        with cls.lock:
-            cls.index += 1
-        return cls.index
+        return next(cls.ids)
+
+    @classmethod
+    def shard(cls, pet_id):
+        """ Returns the Shard that holds the Pet with the given id """
+        return cls.shards[hash(pet_id) % len(cls.shards)]
+
+    @classmethod
+    def __merge(cls, index_name=None, key=None):
+        """ Iterates over the Pets of every shard in id order
+
+        Args:
+            index_name (string): 'categories' or 'names' to select from that index
+            key (string): the category or name to select
+        """
+        iterators = []
+        for shard in cls.shards:
+            index = getattr(shard, index_name) if index_name else None
+            iterators.append(iter(shard.sorted_pets(index, key)))
+        for _, pet in heapq.merge(*iterators):
+            yield pet
+
+    @classmethod
+    def stats(cls):
+        """ Returns the Pet counts per category, the total and the number of distinct names
+
+        The answer is summed from the counters kept by the shards so it never
+        looks at the Pets themselves
+        """
+        total = 0
+        categories = {}
+        for shard in cls.shards:
+            count, category_counts = shard.counts()
+            total += count
+            for category, category_count in category_counts.items():
+                categories[category] = categories.get(category, 0) + category_count
+        return {"total": total, "categories": categories, "names": cls.names.distinct()}
 
     @classmethod
     def all(cls):
         """ Returns all of the Pets in the database """
-        return [pet for pet in cls.data]
+        return list(cls.__merge())
 
     @classmethod
     def remove_all(cls):
         """ Removes all of the Pets from the database """
-        del cls.data[:]
-        cls.index = 0
-        return cls.data
+        for shard in cls.shards:
+            shard.clear()
+        cls.names.clear()
+        cls.ids = itertools.count(1)
+        return cls.all()
 
     @classmethod
     def find(cls, pet_id):
         """ Finds a Pet by it's ID """
-        if not cls.data:
-            return None
-        pets = [pet for pet in cls.data if pet.id == pet_id]
-        if pets:
-            return pets[0]
-        return None
+        return cls.shard(pet_id).get(pet_id)
+
+    @classmethod
+    def find_many(cls, pet_ids):
+        """ Finds the Pets for a list of IDs visiting each shard once
+
+        Args:
+            pet_ids (list): the ids of the Pets you want to find
+
+        Returns:
+            a tuple of the Pets found, in the order of the ids, and the missing ids
+        """
+        unique_ids = []
+        seen = set()
+        by_shard = {}
+        for pet_id in pet_ids:
+            if pet_id not in seen:
+                seen.add(pet_id)
+                unique_ids.append(pet_id)
+                by_shard.setdefault(cls.shard(pet_id), []).append(pet_id)
+        found = {}
+        for shard, shard_ids in by_shard.items():
+            found.update(shard.get_many(shard_ids))
+        pets = [found[pet_id] for pet_id in unique_ids if pet_id in found]
+        missing = [pet_id for pet_id in unique_ids if pet_id not in found]
+        return pets, missing
 
     @classmethod
     def find_by_category(cls, category):
@@ -116,7 +343,7 @@ class Pet(object):
         Args:
             category (string): the category of the Pets you want to match
         """
-        return [pet for pet in cls.data if pet.category == category]
+        return list(cls.__merge('categories', category))
 
     @classmethod
     def find_by_name(cls, name):
@@ -125,4 +352,4 @@ class Pet(object):
         Args:
             name (string): the name of the Pets you want to match
         """
-        return [pet for pet in cls.data if pet.name == name]
+        return list(cls.__merge('names', name))
@@ -0,0 +1,157 @@
+# Copyright 2016, 2017 John Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Request Profiler for Pet Demo Service
+
+Profiles a fraction of the requests with cProfile and keeps the
+aggregated statistics per route in memory
+
+Classes
+-------
+Profiler - Samples requests and aggregates their profiles per route
+
+"""
+import cProfile
+import pstats
+import random
+import threading
+from StringIO import StringIO
+
+# Deepest call stack that is written out as a collapsed stack
+MAX_STACK_DEPTH = 64
+
+class Profiler(object):
+    """
+    Class that samples requests and aggregates their profiles per route
+
+    When the rate is 0 the only cost per request is checking the rate
+    """
+
+    def __init__(self, rate=0.0):
+        """ Initialize a Profiler that samples the given fraction of requests """
+        self.lock = threading.Lock()
+        self.rate = 0.0
+        self.routes = {}
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """ Sets the fraction of requests to profile
+
+        Args:
+            rate (float): a number between 0 (disabled) and 1 (every request)
+        """
+        rate = float(rate)
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError('rate must be between 0 and 1')
+        self.rate = rate
+
+    def sample(self, forced=False):
+        """ Returns a started cProfile.Profile if this request should be profiled """
+        if not (forced or (self.rate and random.random() < self.rate)):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def record(self, route, profile):
+        """ Stops a profile and adds it to the statistics of a route """
+        profile.disable()
+        with self.lock:
+            if route in self.routes:
+                self.routes[route]['stats'].add(profile)
+                self.routes[route]['requests'] += 1
+            else:
+                self.routes[route] = {'stats': pstats.Stats(profile), 'requests': 1}
+
+    def discard(self, profile):
+        """ Stops a profile without keeping its statistics """
+        profile.disable()
+
+    def reset(self):
+        """ Removes all of the collected statistics """
+        with self.lock:
+            self.routes.clear()
+
+    def summary(self):
+        """ Returns the number of requests and total time profiled per route """
+        with self.lock:
+            return dict((route, {'requests': entry['requests'],
+                                 'total_time': entry['stats'].total_tt})
+                        for route, entry in self.routes.items())
+
+    def dump(self, route=None, sort='cumulative', limit=50):
+        """ Returns the pstats report of a route or of every route
+
+        Args:
+            route (string): the route to report on, all routes when None
+            sort (string): the pstats key to sort the report by
+            limit (int): the number of functions to report
+        """
+        stream = StringIO()
+        with self.lock:
+            for name, stats in self.__select(route):
+                stream.write('Route: {}\n'.format(name))
+                stats.stream = stream
+                stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def collapsed(self, route=None):
+        """ Returns the statistics as flame graph compatible collapsed stacks
+
+        cProfile only records caller and callee pairs, so the stacks are
+        rebuilt from the call graph by splitting the time of each function
+        over its callers in proportion to the time spent on each call edge.
+        Times are in microseconds.
+
+        Args:
+            route (string): the route to report on, all routes when None
+        """
+        lines = []
+        with self.lock:
+            graphs = [(name, dict(stats.stats)) for name, stats in self.__select(route)]
+        for name, graph in graphs:
+            totals = {}
+            callees = {}
+            roots = []
+            for func, (_, _, ttime, ctime, callers) in graph.items():
+                totals[func] = (ttime, ctime)
+                known = [caller for caller in callers if caller in graph]
+                if not known:
+                    roots.append(func)
+                for caller in known:
+                    callees.setdefault(caller, []).append((func, callers[caller][3]))
+            stack = [(root, [name, _label(root)], 1.0) for root in roots]
+            while stack:
+                func, path, share = stack.pop()
+                micros = int(round(totals[func][0] * share * 1000000))
+                if micros:
+                    lines.append('{} {}'.format(';'.join(path), micros))
+                if len(path) > MAX_STACK_DEPTH:
+                    continue
+                for callee, edge_time in callees.get(func, []):
+                    callee_time = totals[callee][1]
+                    label = _label(callee)
+                    if not callee_time or label in path:
+                        continue
+                    stack.append((callee, path + [label], share * edge_time / callee_time))
+        return '\n'.join(sorted(lines))
+
+    def __select(self, route):
+        """ Returns the (route, pstats.Stats) pairs to report on, the lock must be held """
+        names = [route] if route else sorted(self.routes)
+        return [(name, self.routes[name]['stats']) for name in names if name in self.routes]
+
+def _label(func):
+    """ Returns the collapsed stack frame name of a pstats function """
+    return pstats.func_std_string(func).replace(';', ':')
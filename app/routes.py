@@ -21,22 +21,40 @@ It demonstraits how a RESTful service should be implemented.
 Paths
 -----
 GET  /pets - Retrieves a list of pets from the database
+GET  /pets?ids={id},{id} - Retrieves the Pets with the given ids and the ids not found
+POST /pets/batch - Retrieves the Pets for a posted list of ids and the ids not found
 GET  /pets{id} - Retrirves a Pet with a specific id
 POST /pets - Creates a Pet in the datbase from the posted database
 PUT  /pets/{id} - Updates a Pet in the database fom the posted database
 DELETE /pets{id} - Removes a Pet from the database that matches the id
+GET  /pets/stats - Retrieves the Pet counts per category, total and name cardinality
+GET  /profiler - Retrieves the profiling rate and the requests profiled per route
+PUT  /profiler - Sets the fraction of requests to profile
+DELETE /profiler - Removes the collected profiling statistics
+GET  /profiler/stats - Retrieves the pstats report of the profiled routes
+GET  /profiler/collapsed - Retrieves the profiled routes as collapsed stacks
 """
 
 import os
 import sys
+import hmac
 import logging
-from flask import Response, jsonify, request, json, url_for, make_response
+from flask import Response, jsonify, request, json, url_for, make_response, g, abort
 from . import app
 from models import Pet, DataValidationError
+from profiler import Profiler
 
 # Pull options from environment
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
 PORT = os.getenv('PORT', '5000')
+PROFILE_RATE = os.getenv('PROFILE_RATE', '0')
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+
+# Requests sent with this header set to PROFILE_TOKEN are always profiled
+# and may use the /profiler administration routes
+PROFILE_HEADER = 'X-Profile'
+
+profiler = Profiler(PROFILE_RATE)
 
 # Status Codes
 HTTP_200_OK = 200
@@ -77,6 +95,30 @@ def internal_server_error(error):
     return jsonify(status=500, error='Internal Server Error', message=error.message), 500
 
 
+######################################################################
+# Request Profiling
+######################################################################
+@app.before_request
+def start_profiling():
+    """ Starts profiling a sample of the requests """
+    if profiler.rate or PROFILE_HEADER in request.headers:
+        # the profiler administration routes are never profiled
+        if not request.path.startswith('/profiler'):
+            g.profile = profiler.sample(profiling_authorized())
+
+@app.teardown_request
+def stop_profiling(error=None):
+    """ Adds the profile of a sampled request to the statistics of its route """
+    profile = g.pop('profile', None)
+    if not profile:
+        return
+    if request.url_rule:
+        profiler.record('{} {}'.format(request.method, request.url_rule.rule), profile)
+    else:
+        # requests that matched no route (404) or method (405) are not kept
+        profiler.discard(profile)
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -95,6 +137,13 @@ def list_pets():
     """ Retrieves a list of pets from the database """
     app.logger.info('Listing pets')
     results = []
+    if 'ids' in request.args:
+        if len(request.args) > 1:
+            raise DataValidationError('Invalid query: ids cannot be combined with other filters')
+        # ids may be repeated as well as comma separated: ?ids=1,2&ids=3
+        ids = [pet_id.strip() for value in request.args.getlist('ids')
+               for pet_id in value.split(',') if pet_id.strip()]
+        return batch_response(ids)
     category = request.args.get('category')
     if category:
         results = Pet.find_by_category(category)
@@ -103,6 +152,26 @@ def list_pets():
 
     return jsonify([pet.serialize() for pet in results]), HTTP_200_OK
 
+######################################################################
+# PET STATISTICS
+######################################################################
+@app.route('/pets/stats', methods=['GET'])
+def get_pet_stats():
+    """ Retrieves the Pet counts per category, total and name cardinality """
+    app.logger.info('Retrieving pet statistics')
+    return jsonify(Pet.stats()), HTTP_200_OK
+
+######################################################################
+# RETRIEVE A BATCH OF PETS
+######################################################################
+@app.route('/pets/batch', methods=['POST'])
+def get_pets_batch():
+    """ Retrieves the Pets for a posted list of ids """
+    payload = request.get_json()
+    if not isinstance(payload, dict) or not isinstance(payload.get('ids'), list):
+        raise DataValidationError('Invalid batch: body of request must contain a list of ids')
+    return batch_response(payload['ids'])
+
 ######################################################################
 # RETRIEVE A PET
 ######################################################################
@@ -143,11 +212,11 @@ def create_pets():
 def update_pets(pet_id):
     """ Updates a Pet in the database fom the posted database """
     app.logger.info('Updating a Pet with id [{}]'.format(pet_id))
-    pet = Pet.find(pet_id)
-    if pet:
-        payload = request.get_json()
-        pet.deserialize(payload)
-        pet.id = pet_id
+    if Pet.find(pet_id):
+        # work on a new Pet so that the stored one and its indexes only
+        # change when the update is saved
+        pet = Pet(pet_id)
+        pet.deserialize(request.get_json())
         pet.save()
         message = pet.serialize()
         return_code = HTTP_200_OK
@@ -181,9 +250,92 @@ def create_demo_data():
     Pet(0, 'kitty', 'cat').save()
     return make_response(jsonify(message='Created demo pets'), HTTP_201_CREATED)
 
+######################################################################
+# PROFILER ADMINISTRATION
+######################################################################
+@app.route('/profiler', methods=['GET'])
+def get_profiler():
+    """ Retrieves the profiling rate and the requests profiled per route """
+    check_profiling_authorized()
+    return jsonify(rate=profiler.rate, routes=profiler.summary()), HTTP_200_OK
+
+@app.route('/profiler', methods=['PUT'])
+def update_profiler():
+    """ Sets the fraction of requests to profile """
+    check_profiling_authorized()
+    payload = request.get_json()
+    if not isinstance(payload, dict) or 'rate' not in payload:
+        raise DataValidationError('Invalid profiler: missing rate')
+    try:
+        profiler.set_rate(payload['rate'])
+    except (TypeError, ValueError):
+        raise DataValidationError('Invalid profiler: rate must be between 0 and 1')
+    app.logger.info('Profiling rate set to {}'.format(profiler.rate))
+    return jsonify(rate=profiler.rate, routes=profiler.summary()), HTTP_200_OK
+
+@app.route('/profiler', methods=['DELETE'])
+def reset_profiler():
+    """ Removes the collected profiling statistics """
+    check_profiling_authorized()
+    app.logger.info('Resetting the profiling statistics')
+    profiler.reset()
+    return make_response('', HTTP_204_NO_CONTENT)
+
+@app.route('/profiler/stats', methods=['GET'])
+def get_profiler_stats():
+    """ Retrieves the pstats report of the profiled routes """
+    check_profiling_authorized()
+    route = request.args.get('route')
+    sort = request.args.get('sort', 'cumulative')
+    try:
+        report = profiler.dump(route, sort)
+    except KeyError:
+        raise DataValidationError('Invalid sort key: {}'.format(sort))
+    return Response(report, status=HTTP_200_OK, mimetype='text/plain')
+
+@app.route('/profiler/collapsed', methods=['GET'])
+def get_profiler_collapsed():
+    """ Retrieves the profiled routes as flame graph compatible collapsed stacks """
+    check_profiling_authorized()
+    report = profiler.collapsed(request.args.get('route'))
+    return Response(report, status=HTTP_200_OK, mimetype='text/plain')
+
 ######################################################################
 #   U T I L I T Y   F U N C T I O N S
 ######################################################################
+def profiling_authorized():
+    """ Returns True if the request carries the profiling token """
+    token = request.headers.get(PROFILE_HEADER)
+    if not PROFILE_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN)
+
+def check_profiling_authorized():
+    """ Hides the profiler routes from requests without the profiling token """
+    if not profiling_authorized():
+        abort(HTTP_404_NOT_FOUND)
+
+def batch_response(ids):
+    """ Returns the Pets found for a list of ids and the ids that are missing """
+    pet_ids = [parse_pet_id(pet_id) for pet_id in ids]
+    app.logger.info('Finding a batch of {} Pets'.format(len(pet_ids)))
+    pets, missing = Pet.find_many(pet_ids)
+    return jsonify(pets=[pet.serialize() for pet in pets], missing=missing), HTTP_200_OK
+
+def parse_pet_id(value):
+    """ Returns a Pet id from an integer or a string of digits
+
+    Booleans and floats are rejected rather than rounded into some other Pet's id
+    """
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    raise DataValidationError('Invalid batch: ids must be integers')
+
 def initialize_logging(log_level=logging.INFO):
     """ Initialized the default logging to STDOUT """
     if not app.debug:
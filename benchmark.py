@@ -0,0 +1,52 @@
+"""
+Pet Store Benchmark
+
+Measures Pet write throughput for an increasing number of threads,
+comparing a single shard against the sharded store
+"""
+
+import os
+import threading
+import time
+from app.models import Pet, Shard, SHARD_COUNT
+
+# Pull options from environment
+WRITES = int(os.getenv('WRITES', '20000'))
+THREADS = [1, 2, 4, 8, 16]
+
+def run(shard_count, thread_count):
+    """ Returns the number of Pet writes per second """
+    writes = WRITES // thread_count
+
+    def worker():
+        """ Creates and then updates Pets """
+        for _ in range(writes):
+            pet = Pet(0, 'fido', 'dog')
+            pet.save()
+            pet.category = 'k9'
+            pet.save()
+
+    # Swap in the shards under test and put the original ones back afterwards
+    shards = Pet.shards
+    Pet.shards = [Shard(Pet.names) for _ in range(shard_count)]
+    Pet.remove_all()
+    try:
+        threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+    finally:
+        Pet.shards = shards
+        Pet.remove_all()
+    return writes * thread_count * 2 / elapsed
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    print '{:>8} {:>16} {:>16}'.format('threads', '1 shard', '{} shards'.format(SHARD_COUNT))
+    for count in THREADS:
+        print '{:>8} {:>16.0f} {:>16.0f}'.format(count, run(1, count), run(SHARD_COUNT, count))
@@ -20,6 +20,7 @@ Test cases can be run with:
   coverage report -m
 """
 
+import threading
 import unittest
 from app.models import Pet, DataValidationError
 
@@ -123,6 +124,17 @@ class TestPets(unittest.TestCase):
         pet = Pet()
         self.assertRaises(DataValidationError, pet.deserialize, "data")
 
+    def test_deserialize_with_bad_types(self):
+        """ Deserialize a Pet with a name or category that is not a string """
+        for data in [{"name": {"a": 1}, "category": "dog"},
+                     {"name": "fido", "category": ["dog"]},
+                     {"name": "fido", "category": 5}]:
+            pet = Pet(1, "rex", "k9")
+            self.assertRaises(DataValidationError, pet.deserialize, data)
+            # nothing is changed by a bad payload
+            self.assertEqual(pet.name, "rex")
+            self.assertEqual(pet.category, "k9")
+
     def test_find_pet(self):
         """ Find a Pet by ID """
         Pet(0, "fido", "dog").save()
@@ -143,6 +155,17 @@ class TestPets(unittest.TestCase):
         pet = Pet.find(2)
         self.assertIs(pet, None)
 
+    def test_find_many(self):
+        """ Find several Pets by ID at once """
+        for i in range(5):
+            Pet(0, "pet%d" % i, "dog").save()
+        pets, missing = Pet.find_many([4, 99, 1, 4, 0])
+        self.assertEqual([pet.id for pet in pets], [4, 1])
+        self.assertEqual(missing, [99, 0])
+        pets, missing = Pet.find_many([])
+        self.assertEqual(pets, [])
+        self.assertEqual(missing, [])
+
     def test_find_by_category(self):
         """ Find Pets by Category """
         Pet(0, "fido", "dog").save()
@@ -161,6 +184,91 @@ class TestPets(unittest.TestCase):
         self.assertEqual(pets[0].category, "cat")
         self.assertEqual(pets[0].name, "kitty")
 
+    def test_stats(self):
+        """ Pet stats follow saves, updates and deletes """
+        self.assertEqual(Pet.stats(), {"total": 0, "categories": {}, "names": 0})
+        fido = Pet(0, "fido", "dog")
+        fido.save()
+        Pet(0, "rex", "dog").save()
+        Pet(0, "fido", "cat").save()
+        stats = Pet.stats()
+        self.assertEqual(stats["total"], 3)
+        self.assertEqual(stats["categories"], {"dog": 2, "cat": 1})
+        self.assertEqual(stats["names"], 2)
+        # change the category in place and save it
+        fido.category = "k9"
+        fido.save()
+        stats = Pet.stats()
+        self.assertEqual(stats["total"], 3)
+        self.assertEqual(stats["categories"], {"dog": 1, "cat": 1, "k9": 1})
+        fido.delete()
+        stats = Pet.stats()
+        self.assertEqual(stats["total"], 2)
+        self.assertEqual(stats["categories"], {"dog": 1, "cat": 1})
+        self.assertEqual(stats["names"], 2)
+        Pet.remove_all()
+        self.assertEqual(Pet.stats(), {"total": 0, "categories": {}, "names": 0})
+
+    def test_stats_use_counters(self):
+        """ Pet stats are answered without looking at the Pets """
+        class Unreadable(dict):
+            """ A dictionary that fails when its contents are read in bulk """
+            def fail(self, *args):
+                raise AssertionError('stats() must not iterate over the Pets')
+            __iter__ = keys = values = items = iterkeys = itervalues = iteritems = fail
+        for i in range(10):
+            Pet(0, "pet%d" % i, "dog" if i % 2 else "cat").save()
+        for shard in Pet.shards:
+            shard.pets = Unreadable(shard.pets)
+            shard.names = Unreadable(shard.names)
+            shard.categories = Unreadable(shard.categories)
+        try:
+            stats = Pet.stats()
+        finally:
+            for shard in Pet.shards:
+                shard.pets = dict(shard.pets)
+                shard.names = dict(shard.names)
+                shard.categories = dict(shard.categories)
+        self.assertEqual(stats["total"], 10)
+        self.assertEqual(stats["categories"], {"dog": 5, "cat": 5})
+        self.assertEqual(stats["names"], 10)
+
+    def test_save_with_unusable_keys(self):
+        """ A Pet that cannot be indexed is not stored at all """
+        self.assertRaises(TypeError, Pet(0, {"a": 1}, "dog").save)
+        self.assertRaises(TypeError, Pet(0, "fido", ["dog"]).save)
+        self.assertEqual(Pet.all(), [])
+        self.assertEqual(Pet.find_by_category("dog"), [])
+        self.assertEqual(Pet.stats(), {"total": 0, "categories": {}, "names": 0})
+
+    def test_pets_are_sharded(self):
+        """ Pets are spread across shards and merged in id order """
+        for i in range(len(Pet.shards) * 2):
+            Pet(0, "pet%d" % i, "dog" if i % 2 else "cat").save()
+        for shard in Pet.shards:
+            self.assertEqual(len(shard.pets), 2)
+        pets = Pet.all()
+        self.assertEqual([pet.id for pet in pets], range(1, len(Pet.shards) * 2 + 1))
+        cats = Pet.find_by_category("cat")
+        self.assertEqual(len(cats), len(Pet.shards))
+        self.assertEqual([pet.id for pet in cats], sorted(pet.id for pet in cats))
+        self.assertEqual(Pet.find(3).name, "pet2")
+
+    def test_concurrent_saves(self):
+        """ Save Pets from several threads """
+        def worker():
+            for _ in range(100):
+                Pet(0, "fido", "dog").save()
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pets = Pet.all()
+        self.assertEqual(len(pets), 800)
+        self.assertEqual(len(set(pet.id for pet in pets)), 800)
+        self.assertEqual(Pet.stats()["categories"], {"dog": 800})
+
 
 ######################################################################
 #   M A I N
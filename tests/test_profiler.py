@@ -0,0 +1,109 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test cases for the Request Profiler
+
+Test cases can be run with:
+  nosetests
+  coverage report -m
+"""
+
+import sys
+import unittest
+from app.profiler import Profiler
+
+def busy():
+    """ Does some work for the profiler to record """
+    return sum(range(100000))
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestProfiler(unittest.TestCase):
+    """ Test Cases for the Profiler """
+
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def profile(self, route):
+        """ Profile a call to busy() for a route """
+        profile = self.profiler.sample(forced=True)
+        busy()
+        self.profiler.record(route, profile)
+
+    def test_disabled_by_default(self):
+        """ A Profiler with a rate of 0 does not sample """
+        self.assertEqual(self.profiler.rate, 0.0)
+        self.assertIs(self.profiler.sample(), None)
+
+    def test_sample_every_request(self):
+        """ A Profiler with a rate of 1 samples every request """
+        self.profiler.set_rate(1)
+        profile = self.profiler.sample()
+        self.assertIsNot(profile, None)
+        profile.disable()
+
+    def test_discard(self):
+        """ A discarded profile is stopped and not kept """
+        profile = self.profiler.sample(forced=True)
+        self.profiler.discard(profile)
+        self.assertIs(sys.getprofile(), None)
+        self.assertEqual(self.profiler.summary(), {})
+
+    def test_set_bad_rate(self):
+        """ Set a rate outside of 0 to 1 """
+        self.assertRaises(ValueError, self.profiler.set_rate, 2)
+        self.assertRaises(ValueError, self.profiler.set_rate, -0.5)
+        self.assertRaises(ValueError, self.profiler.set_rate, 'all')
+
+    def test_summary(self):
+        """ Profiles are aggregated per route """
+        self.profile('GET /pets')
+        self.profile('GET /pets')
+        self.profile('POST /pets')
+        summary = self.profiler.summary()
+        self.assertEqual(summary['GET /pets']['requests'], 2)
+        self.assertEqual(summary['POST /pets']['requests'], 1)
+        self.profiler.reset()
+        self.assertEqual(self.profiler.summary(), {})
+
+    def test_dump(self):
+        """ Dump the pstats report of a route """
+        self.profile('GET /pets')
+        self.profile('POST /pets')
+        report = self.profiler.dump('GET /pets')
+        self.assertIn('Route: GET /pets', report)
+        self.assertIn('busy', report)
+        self.assertNotIn('POST /pets', report)
+        self.assertIn('POST /pets', self.profiler.dump())
+        self.assertEqual(self.profiler.dump('GET /nothing'), '')
+
+    def test_collapsed(self):
+        """ Write the profiles as collapsed stacks """
+        self.profile('GET /pets')
+        lines = self.profiler.collapsed().split('\n')
+        self.assertTrue(lines)
+        for line in lines:
+            stack, micros = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('GET /pets;'))
+            self.assertTrue(int(micros) > 0)
+        self.assertTrue(any('(busy)' in line for line in lines))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
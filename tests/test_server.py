@@ -21,11 +21,15 @@ Test cases can be run with:
 """
 
 import logging
+import sys
 import unittest
 import json
 from flask_api import status    # HTTP Status Codes
 import app.routes as service
 
+# Token that unlocks the profiler during the tests
+TOKEN = 'secret'
+
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
@@ -37,6 +41,13 @@ class TestPetServer(unittest.TestCase):
         """ Run once before all tests """
         service.app.debug = False
         service.initialize_logging(logging.ERROR)
+        cls.profile_token = service.PROFILE_TOKEN
+        service.PROFILE_TOKEN = TOKEN
+
+    @classmethod
+    def tearDownClass(cls):
+        """ Run once after all tests """
+        service.PROFILE_TOKEN = cls.profile_token
 
     def setUp(self):
         """ Runs before each test """
@@ -48,6 +59,8 @@ class TestPetServer(unittest.TestCase):
     def tearDown(self):
         """ Runs after each test """
         service.Pet.remove_all()
+        service.profiler.set_rate(0)
+        service.profiler.reset()
 
     def test_index(self):
         """ Test the Home Page """
@@ -130,6 +143,26 @@ class TestPetServer(unittest.TestCase):
         resp = self.app.put('/pets/2', data=data, content_type='application/json')
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_update_pet_with_no_category(self):
+        """ A failed update leaves the Pet unchanged """
+        data = json.dumps({'name': 'rex'})
+        resp = self.app.put('/pets/1', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/pets/1')
+        self.assertEqual(json.loads(resp.data)['name'], 'fido')
+        self.assertEqual([pet.id for pet in service.Pet.find_by_name('fido')], [1])
+        self.assertEqual(service.Pet.find_by_name('rex'), [])
+
+    def test_update_pet_indexes(self):
+        """ An update moves the Pet in the name and category indexes """
+        data = json.dumps({'name': 'rex', 'category': 'k9'})
+        resp = self.app.put('/pets/1', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(service.Pet.find_by_name('fido'), [])
+        self.assertEqual([pet.id for pet in service.Pet.find_by_name('rex')], [1])
+        self.assertEqual([pet.id for pet in service.Pet.find_by_category('k9')], [1])
+        self.assertEqual(service.Pet.find_by_category('dog'), [])
+
     def test_update_pet_not_found(self):
         """ Update a Pet that can't be found """
         new_kitty = {"name": "timothy", "category": "mouse"}
@@ -171,6 +204,197 @@ class TestPetServer(unittest.TestCase):
         query_item = data[0]
         self.assertEqual(query_item['category'], 'dog')
 
+    def test_get_pets_by_ids(self):
+        """ Get several Pets with a list of ids """
+        resp = self.app.get('/pets', query_string='ids=2,5,1')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([pet['name'] for pet in data['pets']], ['kitty', 'fido'])
+        self.assertEqual(data['missing'], [5])
+
+    def test_get_pets_by_repeated_ids(self):
+        """ Get several Pets with the ids parameter repeated """
+        resp = self.app.get('/pets', query_string='ids=1&ids=2,7')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([pet['id'] for pet in data['pets']], [1, 2])
+        self.assertEqual(data['missing'], [7])
+
+    def test_get_pets_by_bad_ids(self):
+        """ Get several Pets with ids that are not numbers """
+        for ids in ['1,two', '1.9', '1,true']:
+            resp = self.app.get('/pets', query_string='ids=' + ids)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_pets_by_ids_and_category(self):
+        """ Get several Pets with ids and another filter """
+        resp = self.app.get('/pets', query_string='ids=1&category=cat')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_pets_batch(self):
+        """ Get several Pets with a posted list of ids """
+        data = json.dumps({'ids': [1, 3]})
+        resp = self.app.post('/pets/batch', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([pet['name'] for pet in data['pets']], ['fido'])
+        self.assertEqual(data['missing'], [3])
+
+    def test_get_pets_batch_with_string_ids(self):
+        """ Get several Pets with ids posted as strings """
+        data = json.dumps({'ids': ['2', 1]})
+        resp = self.app.post('/pets/batch', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual([pet['id'] for pet in data['pets']], [2, 1])
+        self.assertEqual(data['missing'], [])
+
+    def test_get_pets_batch_with_no_ids(self):
+        """ Get several Pets without posting a list of ids """
+        for payload in [{}, {'ids': '1,2'}, {'ids': [{}]}, {'ids': [1.9]}, {'ids': [True]},
+                        {'ids': ['1.5']}]:
+            data = json.dumps(payload)
+            resp = self.app.post('/pets/batch', data=data, content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_pet_with_bad_types(self):
+        """ Create a Pet with a name or category that is not a string """
+        for new_pet in [{'name': {'a': 1}, 'category': 'dog'},
+                        {'name': 'sammy', 'category': ['snake']}]:
+            data = json.dumps(new_pet)
+            resp = self.app.post('/pets', data=data, content_type='application/json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        # the store is left untouched and consistent
+        self.assertEqual(self.get_pet_count(), 2)
+        resp = self.app.get('/pets', query_string='category=dog')
+        self.assertEqual(len(json.loads(resp.data)), 1)
+        data = json.loads(self.app.get('/pets/stats').data)
+        self.assertEqual(data, {'total': 2, 'categories': {'dog': 1, 'cat': 1}, 'names': 2})
+        resp = self.app.delete('/pets/2')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_pet_stats_with_bad_category(self):
+        """ Pets with a category that is not a string are not counted """
+        data = json.dumps({'name': 'five', 'category': 5})
+        resp = self.app.post('/pets', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = json.dumps({'name': 'five', 'category': '5'})
+        resp = self.app.post('/pets', data=data, content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.get('/pets/stats')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['categories'], {'dog': 1, 'cat': 1, '5': 1})
+
+    def test_get_pet_stats(self):
+        """ Get the Pet statistics """
+        resp = self.app.get('/pets/stats')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['categories'], {'dog': 1, 'cat': 1})
+        self.assertEqual(data['names'], 2)
+        # deleting a pet is reflected in the counts
+        resp = self.app.delete('/pets/2', content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get('/pets/stats')
+        data = json.loads(resp.data)
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['categories'], {'dog': 1})
+
+    def test_profile_with_header(self):
+        """ Profile a request that asks for it """
+        resp = self.app.get('/pets', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get('/profiler', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(data['rate'], 0)
+        self.assertEqual(data['routes']['GET /pets']['requests'], 1)
+        resp = self.app.get('/profiler/stats', headers={'X-Profile': TOKEN}, query_string='route=GET /pets')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('list_pets', resp.data)
+        resp = self.app.get('/profiler/collapsed', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('GET /pets;', resp.data)
+        resp = self.app.get('/profiler/stats', headers={'X-Profile': TOKEN}, query_string='sort=bogus')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.delete('/profiler', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        data = json.loads(self.app.get('/profiler', headers={'X-Profile': TOKEN}).data)
+        self.assertEqual(data['routes'], {})
+
+    def test_profile_unmatched_request(self):
+        """ Profiling stops for requests that match no route or method """
+        resp = self.app.get('/nope', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIs(sys.getprofile(), None)
+        resp = self.app.post('/pets/0', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertIs(sys.getprofile(), None)
+        self.assertEqual(service.profiler.summary(), {})
+
+    def test_set_profiling_rate(self):
+        """ Profile every request after setting the rate """
+        data = json.dumps({'rate': 1})
+        resp = self.app.put('/profiler', data=data, content_type='application/json',
+                                headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.app.get('/pets/1')
+        self.app.get('/pets/2')
+        data = json.dumps({'rate': 0})
+        resp = self.app.put('/profiler', data=data, content_type='application/json',
+                                headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = json.loads(resp.data)
+        self.assertEqual(data['routes']['GET /pets/<int:pet_id>']['requests'], 2)
+        self.assertNotIn('PUT /profiler', data['routes'])
+
+    def test_profiler_routes_not_sampled(self):
+        """ The profiler routes are not profiled when a rate is set """
+        service.profiler.set_rate(1)
+        resp = self.app.get('/profiler/stats', headers={'X-Profile': TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get('/profiler', headers={'X-Profile': TOKEN})
+        data = json.loads(resp.data)
+        self.assertEqual(data['routes'], {})
+
+    def test_set_bad_profiling_rate(self):
+        """ Set a profiling rate that is not valid """
+        for payload in [{'rate': 5}, {'rate': 'all'}, {}]:
+            data = json.dumps(payload)
+            resp = self.app.put('/profiler', data=data, content_type='application/json',
+                                headers={'X-Profile': TOKEN})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(service.profiler.rate, 0)
+
+    def test_profiler_needs_token(self):
+        """ The profiler is hidden from requests without the token """
+        for headers in [{}, {'X-Profile': 'guess'}]:
+            resp = self.app.get('/pets', headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            for url in ['/profiler', '/profiler/stats', '/profiler/collapsed']:
+                resp = self.app.get(url, headers=headers)
+                self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+            data = json.dumps({'rate': 1})
+            resp = self.app.put('/profiler', data=data, content_type='application/json',
+                                headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(service.profiler.rate, 0)
+        self.assertEqual(service.profiler.summary(), {})
+
+    def test_profiler_disabled_without_token(self):
+        """ The profiler cannot be used when no token is configured """
+        service.PROFILE_TOKEN = None
+        try:
+            self.app.get('/pets', headers={'X-Profile': TOKEN})
+            resp = self.app.get('/profiler', headers={'X-Profile': TOKEN})
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        finally:
+            service.PROFILE_TOKEN = TOKEN
+        self.assertEqual(service.profiler.summary(), {})
+
     def test_method_not_allowed(self):
         """ Call a Method thats not Allowed """
         resp = self.app.post('/pets/0')